@@ -1,13 +1,20 @@
 import mechanicalsoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 #import certifi
 from datetime import datetime, timedelta
 import time
 import keyring
+import ijson
 import getpass
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+import pyarrow.parquet as pq
 import zipfile
-import io
 import os
+import shutil
+import tempfile
 
 class RITIS_Downloader:
     '''
@@ -18,9 +25,10 @@ class RITIS_Downloader:
 
     Three different methods of downloading data are provided, including:
 
-        1. single_download() - One-time download for single date range
+        1. single_download() - One-time download for single date range. Dates can be 'YYYY-MM-DD' strings or date/datetime objects.
         2. daily_download() - Download data for each day starting at the date in the last_run file (default is last_run.txt) through yesterday. This method is intended to be called on a daily schedule, for example, use Windows task scheduler to run at 1am each morning.
         3. continuous_download() - Meant to run as a background process throughout the day. It downloads most recent data on regular intervals, like each hour. After the end_time has elapsed then the process terminates. This method is meant to be run on a daily schedule, just like the daily_download() method.
+           Today's parquet file is only written when the process ends (after end_time, or when interrupted), until then new data is kept in a <date>.arrows Arrow IPC stream file.
     
     Do not schedule both daily_download() and continuous_download() to run, only pick one method to use.
     When continuous_download() is run, it will call daily_download() first to make sure data is updated through yesterday, if needed.
@@ -33,7 +41,8 @@ class RITIS_Downloader:
     '''
     def __init__(self, segments_path='XD_segments.txt', download_path='Data', start_time='00:00:00', end_time='23:59:00', 
         bin_size=15, units="seconds", columns = ["speed","average_speed","reference_speed","travel_time_minutes","confidence_score","cvalue"],
-        confidence_score=[30, 20, 10], last_run='last_run.txt', continuous_download_interval=60, browser_verification=True):
+        confidence_score=[30, 20, 10], last_run='last_run.txt', continuous_download_interval=60, browser_verification=True,
+        sort_output=False):
         
         # Set user variables
         self.download_path = f'{download_path}/' #path data is downloaded to
@@ -45,15 +54,16 @@ class RITIS_Downloader:
         self.confidence_score = confidence_score #provide list including 10 and/or 20 and/or 30 [10,20,30] see RITIS help for details, but 30 is best
         self.last_run = last_run #file name storing date that daily_download() was last run
         self.continuous_download_interval = continuous_download_interval #interval at which continuous_download() will download new data, in minutes
+        self.sort_output = sort_output #sort saved files by XD and TimeStamp, off by default since parquet readers can filter/sort on read
         
         # This option is provided to allow running the MechanicalSoup browser without verification.
         # To run the code when connected to the internet through the ODOT VPN, set browser_verification=False
         # If connecting to internet generally then leave verification on
         self.verify = browser_verification
 
-        # Get XD segments list (remove spaces)
+        # Get XD segments (remove spaces and empty entries), stored as a tuple since it is shared by the submit json and never changes
         with open(segments_path, 'r') as file:
-            self.xd_segments = [x.strip() for x in file.read().split(',')]
+            self.xd_segments = tuple(x for x in (x.strip() for x in file.read().split(',')) if x)
 
         # Get dir of this file
         self.dir = os.path.dirname(os.path.realpath(__file__))
@@ -73,6 +83,9 @@ class RITIS_Downloader:
         return f'https://pda.ritis.org/export/download/{uuid}?dl=1'
 
     def _get_credentials(self):
+        # Reuse credentials already looked up by this instance, each keyring lookup is a Credential Manager call on Windows
+        if getattr(self, '_creds', None) is not None:
+            return self._creds
         try:
             email = keyring.get_password('RITIS', 'email')
             password = keyring.get_password('RITIS', email)
@@ -88,7 +101,8 @@ class RITIS_Downloader:
                 keyring.set_password('RITIS', email, password)
                 print('\n\Email and password saved in Credential Manager under RITIS.')
                 print('There are two credentials with that name, one used to look up email, the other uses email to look up password.')
-        return email, password 
+        self._creds = (email, password)
+        return self._creds
 
     def _login(self):
         email, password = self._get_credentials()
@@ -106,9 +120,56 @@ class RITIS_Downloader:
         response = browser.submit_selected()
         if response.status_code == 200:
             print('Logged in')
+        # Reuse one pooled keep-alive session for all polls/downloads so the TLS handshake is only paid once
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.5))
+        browser.session.mount('http://', adapter)
+        browser.session.mount('https://', adapter)
+        browser.session.headers['Connection'] = 'keep-alive'
         return browser, email
 
 
+    def _get_submit_template(self):
+        # Static part of the submit job json, reused for every job. This was derived from the POST that gets sent by clicking the SUBMIT button.
+        # Using the Dev Tools network tab, the cURL was coppied and transformed into json by ChatGPT. Thank you, AI overlord!
+        # This idea was inspired by https://www.youtube.com/watch?v=DqtlR0y0suo
+        # Updated map, and changed atlas version to 54 in September 2023
+        # It is only rebuilt when one of the settings it uses has been changed since the last job
+        settings = (tuple(self.columns), tuple(self.confidence_score), self.bin_size, self.units, self.atlas_version, self.xd_segments)
+        if getattr(self, '_submit_settings', None) != settings:
+            self._submit_settings = settings
+            self._submit_template = {
+                "DATASOURCES": [{
+                    "id": "inrix_xd",
+                    "columns": self.columns,
+                    "quality_filter": {
+                        "thresholds": self.confidence_score
+                    }
+                }],
+                "ROADPROVIDER": "inrix_xd",
+                "TMCS": self.xd_segments,
+                "ROAD_DETAILS": [{
+                    "SEGMENT_IDS": self.xd_segments,
+                    "DATASOURCE_ID": "inrix_xd",
+                    "ATLAS_VERSION_ID": self.atlas_version
+                }],
+                "ENTIREROAD": False,
+                "DESCRIPTION": "Why did the traffic signal cross the road?",
+                "AVERAGINGWINDOWSIZE": self.bin_size,
+                "SENDNOTIFICATIONEMAIL": False,
+                "ADDNULLRECORDS": False,
+                "TRAVELTIMEUNITS": self.units,
+                "COUNTRYCODE": "USA"
+            }
+        return self._submit_template
+
+    def _to_date(self, value):
+        # Dates can be given as ISO format strings like 'YYYY-MM-DD', or as date/datetime objects (a pandas Timestamp is a datetime)
+        if isinstance(value, str):
+            return datetime.fromisoformat(value.strip()).date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
     def _submit_job(self, browser, email, start_date, end_date, name, start_time=None, end_time=None):
         # Use default start/end times if none given
         if start_time is None:
@@ -116,43 +177,19 @@ class RITIS_Downloader:
         if end_time is None:
             end_time = self.end_time
         
-        # Create list of date ranges
-        date_list = pd.date_range(start_date, end_date)
-        date_list = [date.strftime("%Y-%m-%d") for date in date_list]
-        date_ranges = [{'start_date': f'{date} {start_time}', 'end_date': f'{date} {end_time}'} for date in date_list]
-
-        # Plug variables into data json. This was derived from the POST that gets sent by clicking the SUBMIT button.
-        # Using the Dev Tools network tab, the cURL was coppied and transformed into json by ChatGPT. Thank you, AI overlord!
-        # This idea was inspired by https://www.youtube.com/watch?v=DqtlR0y0suo
-        # Updated map, and changed atlas version to 54 in September 2023
-        data = {
-            "DATASOURCES": [{
-                "id": "inrix_xd",
-                "columns": self.columns,
-                "quality_filter": {
-                    "thresholds": self.confidence_score
-                }
-            }],
-            "ROADPROVIDER": "inrix_xd",
-            "TMCS": self.xd_segments,
-            "ROAD_DETAILS": [{
-                "SEGMENT_IDS": self.xd_segments,
-                "DATASOURCE_ID": "inrix_xd",
-                "ATLAS_VERSION_ID": self.atlas_version
-            }],
-            "DATERANGES": date_ranges,
-            "ENTIREROAD": False,
-            "NAME": name,
-            "DESCRIPTION": "Why did the traffic signal cross the road?",
-            "AVERAGINGWINDOWSIZE": self.bin_size,
-            "EMAILADDRESS": email,
-            "SENDNOTIFICATIONEMAIL": False,
-            "ADDNULLRECORDS": False,
-            "TRAVELTIMEUNITS": self.units,
-            "COUNTRYCODE": "USA"
-        }
-
-        browser.post(self.url_submit, json=data)
+        # Create list of date ranges, one for each day from start_date through end_date
+        date = self._to_date(start_date)
+        end = self._to_date(end_date)
+        date_ranges = []
+        while date <= end:
+            date_str = date.isoformat()
+            date_ranges.append({'start_date': f'{date_str} {start_time}', 'end_date': f'{date_str} {end_time}'})
+            date += timedelta(days=1)
+
+        # Only the per-job fields change, the rest of the payload is the cached template
+        data = {**self._get_submit_template(), "DATERANGES": date_ranges, "NAME": name, "EMAILADDRESS": email}
+
+        browser.session.post(self.url_submit, json=data, verify=self.verify)
         print(f'Submitted job for {name}')
 
 
@@ -175,59 +212,190 @@ class RITIS_Downloader:
 
     def _update_job_status(self, browser, jobs):
         # Job status from RITIS, in JSON format
-        history = browser.post(self.url_history).json() 
-        # Update each job with uuid and status (pending=1, ready=2, downloaded=3)
-        for key, value in jobs.items():
-            for data in history:
-                if data["description"] == key:
-                    jobs[key]['uuid'] = data["uuid"]
-                    jobs[key]['status'] = data["status"]
-                    jobs[key]['downloaded'] = data["downloaded"]
-                    break
+        # The history grows with every job ever run, so stream-parse it and stop parsing as soon as every job has been found
+        wanted = set(jobs)
+        with browser.session.post(self.url_history, verify=self.verify, stream=True) as response:
+            response.raw.decode_content = True
+            # Update each job with uuid and status (pending=1, ready=2, downloaded=3), the first matching entry wins
+            for data in ijson.items(response.raw, 'item'):
+                key = data["description"]
+                if key in wanted:
+                    wanted.discard(key)
+                    # Keep a job downloaded by this process marked as downloaded even if the server hasn't caught up yet
+                    jobs[key].update(uuid=data["uuid"], status=data["status"], downloaded=jobs[key].get('downloaded', False) or data["downloaded"])
+                    if not wanted:
+                        break
+            # Read the rest of the body without parsing it, a partly read response closes its connection instead of returning it to the pool
+            for chunk in response.iter_content(1 << 16):
+                pass
         return jobs
 
-    # Function by ChatGPT, extracts file from zipped folder without saving to local drive so less work overall
-    def _extract_file_to_df(self, data, file_name):
-        # Create a BytesIO object from the data
-        data = io.BytesIO(data)
-        # Open the zip file from the BytesIO object
-        with zipfile.ZipFile(data) as zip_ref:
-            # Extract the specific file to a BytesIO object
-            with zip_ref.open(file_name) as file:
-                extracted_file = io.BytesIO(file.read())
-        # Create a pandas dataframe from the extracted file
-        df = pd.read_csv(extracted_file, parse_dates=['measurement_tstamp'])
-        df = df.set_index(['xd_id', 'measurement_tstamp'])
-        df.index.names = ['XD', 'TimeStamp']
-        df = df.astype('float32')
-        df = df.sort_index(level=0)
-        return df
+    def _get_convert_options(self):
+        # Column types for parsing downloaded csv files so value columns parse straight to float32,
+        # cached and only rebuilt if self.columns has been changed since the last download
+        columns = tuple(self.columns)
+        if getattr(self, '_convert_columns', None) != columns:
+            self._convert_columns = columns
+            column_types = {column: pa.float32() for column in columns}
+            column_types['xd_id'] = pa.int64()
+            column_types['measurement_tstamp'] = pa.timestamp('s')
+            self._convert_options = csv.ConvertOptions(column_types=column_types)
+        return self._convert_options
+
+    # Function by ChatGPT, extracts file from zipped folder without saving the extracted csv to local drive so less work overall
+    # The csv is read in blocks and written out in row groups of up to ~1M rows. At most ~1M rows are buffered across all output files,
+    # so memory stays around one row group plus one block no matter how large the file is
+    def _extract_file_to_parquet(self, data, file_name, name, split_by_date=False, sort=False):
+        row_group_size = 1_048_576
+        writers = {} # parquet writers by output file name, there is one per date when split_by_date is set
+        pending = {} # batches not yet written by output file name
+        pending_rows = {} # number of rows in pending by output file name
+        rows = 0
+
+        def write_pending(writer_name, final=False):
+            # Write as many full row groups as are buffered, or everything that is buffered if final
+            table = pa.Table.from_batches(pending.pop(writer_name), schema)
+            del pending_rows[writer_name]
+            size = table.num_rows if final else table.num_rows - table.num_rows % row_group_size
+            if size:
+                if writer_name not in writers:
+                    writers[writer_name] = self._parquet_writer(writer_name, schema)
+                writers[writer_name].write_table(table.slice(0, size), row_group_size=row_group_size)
+            if size < table.num_rows:
+                pending[writer_name] = table.slice(size).to_batches()
+                pending_rows[writer_name] = table.num_rows - size
+
+        def add_batch(writer_name, batch):
+            pending.setdefault(writer_name, []).append(batch)
+            pending_rows[writer_name] = pending_rows.get(writer_name, 0) + batch.num_rows
+            if pending_rows[writer_name] >= row_group_size:
+                write_pending(writer_name)
+            # The csv is ordered by segment so with split_by_date each block covers every date, when too many rows are buffered
+            # write out the file with the most, accepting a smaller row group to keep memory bounded
+            while sum(pending_rows.values()) > row_group_size:
+                write_pending(max(pending_rows, key=pending_rows.get), final=True)
+
+        # Open the zip file from the file object, zipfile needs to seek so data can't be the raw socket
+        with zipfile.ZipFile(data) as zip_ref, zip_ref.open(file_name) as file:
+            # Stream the csv straight from the zip member with the Arrow reader, going directly to float32
+            reader = csv.open_csv(file, read_options=csv.ReadOptions(block_size=16 << 20),
+                convert_options=self._get_convert_options())
+            names = {'xd_id': 'XD', 'measurement_tstamp': 'TimeStamp'}
+            schema = pa.schema([field.with_name(names.get(field.name, field.name)) for field in reader.schema])
+            try:
+                for batch in reader:
+                    batch = pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+                    rows += batch.num_rows
+                    if split_by_date:
+                        # Multi-day job, save a parquet file for each date
+                        dates = batch.column('TimeStamp').cast(pa.date32())
+                        for date in pc.unique(dates).to_pylist():
+                            add_batch(date.strftime("%Y-%m-%d"), batch.filter(pc.equal(dates, date)))
+                    else:
+                        add_batch(name, batch)
+                for writer_name in list(pending):
+                    write_pending(writer_name, final=True)
+                for writer in writers.values():
+                    writer.close()
+            except BaseException:
+                # Remove partially written files so they aren't mistaken for complete downloads
+                for writer_name, writer in writers.items():
+                    writer.close()
+                    os.remove(f'{self.download_path}{writer_name}.parquet')
+                raise
+        for writer_name in writers:
+            print('Saved parquet file for ', writer_name)
+        if sort:
+            for writer_name in writers:
+                self._sort_parquet(writer_name)
+        # Number of rows and the names of the files that were saved
+        return rows, list(writers)
+
+    def _parquet_writer(self, name, schema, sorting_columns=None):
+        # Parquet writer for a file in the download path, zstd is smaller than the default snappy and XD dictionary-encodes well
+        return pq.ParquetWriter(f'{self.download_path}{name}.parquet', schema, compression='zstd', compression_level=3,
+            use_dictionary=['XD'], sorting_columns=sorting_columns)
+
+    def _sort_parquet(self, name):
+        # Rewrite a saved file sorted by XD then TimeStamp
+        self._write_sorted(name, pq.read_table(f'{self.download_path}{name}.parquet'))
+
+    def _write_sorted(self, name, table):
+        # Save a table sorted by XD then TimeStamp, recording the order in the sorting_columns metadata for readers
+        table = table.sort_by([('XD', 'ascending'), ('TimeStamp', 'ascending')])
+        sorting_columns = [pq.SortingColumn(table.schema.get_field_index(column)) for column in ['XD', 'TimeStamp']]
+        with self._parquet_writer(name, table.schema, sorting_columns=sorting_columns) as writer:
+            writer.write_table(table, row_group_size=1_048_576)
+
+    def _download_one(self, browser, key, job):
+        # The zip is streamed to a temporary file in chunks rather than held in memory as response.content
+        print(f'Downloading {key}')
+        url = self._download_link(job['uuid'])
+        with browser.session.get(url, verify=self.verify, stream=True) as response, tempfile.TemporaryFile() as data:
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, data, 1 << 20)
+            data.seek(0)
+            # Extract file into parquet
+            rows, saved = self._extract_file_to_parquet(data, f'{key}.csv', key, split_by_date=job.get('split_by_date', False),
+                sort=job.get('sort', self.sort_output))
+        # Assert that the data is not empty
+        assert rows > 0, f"Data is empty for {key}"
+        # Assert that a multi-day job has data for every date, otherwise last_run would move past a missing day and it would never be retried
+        missing = [date for date in job.get('dates', []) if date not in saved]
+        assert not missing, f"Data is empty for {', '.join(missing)} in {key}"
+        # Mark as downloaded so the next status poll doesn't download it again
+        job['downloaded'] = True
 
     def _download_job(self, browser, jobs):
         # Download all jobs that are ready
-        # This downloads the data, the content has to be saved as a zip folder
-        for key, value in jobs.items():
-            if jobs[key]['status'] == 3 and jobs[key]['downloaded'] == False:
-                print(f'Downloading {key}')
-                url = self._download_link(jobs[key]['uuid'])
-                response = browser.open(url)
-                # Extract file into dataframe
-                df = self._extract_file_to_df(response.content, f'{key}.csv')
-                # Assert that the data is not empty
-                assert not df.empty, f"Data is empty for {key}"
-                # Save the data as a parquet file
-                df.to_parquet(f'{self.download_path}{key}.parquet')
-                print('Saved parquet file for ', key)
-
-
-    def _download_all_remaining(self, browser, jobs, sleep=60*2):
-        # Download all remaining jobs
+        for key, job in jobs.items():
+            if job['status'] == 3 and job['downloaded'] == False:
+                self._download_one(browser, key, job)
+
+    def _compact_today(self, today):
+        # Combine today's parquet file (saved by an earlier run, if any) and today's Arrow stream into one parquet file, then remove the stream.
+        # The stream only holds intervals that aren't in the parquet file yet, and the new file replaces the old one only once it is complete
+        existing = None
+        if os.path.isfile(f'{self.download_path}{today}.parquet'):
+            existing = pq.read_table(f'{self.download_path}{today}.parquet')
+        tables = []
+        schema = None
+        batches = []
+        try:
+            with pa.OSFile(f'{self.download_path}{today}.arrows', 'rb') as source, pa.ipc.open_stream(source) as reader:
+                schema = reader.schema
+                for batch in reader:
+                    batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass # the stream was cut off by a killed process, keep the complete batches
+        if schema is not None:
+            tables.append(pa.Table.from_batches(batches, schema))
+        if existing is not None:
+            if schema is not None:
+                # A file saved by an older version has a different column order and nanosecond timestamps, match the stream
+                existing = existing.select(schema.names).cast(schema)
+            tables.insert(0, existing)
+        if tables:
+            table = pa.concat_tables(tables)
+            if self.sort_output:
+                self._write_sorted(f'{today}.tmp', table)
+            else:
+                with self._parquet_writer(f'{today}.tmp', table.schema) as writer:
+                    writer.write_table(table, row_group_size=1_048_576)
+            os.replace(f'{self.download_path}{today}.tmp.parquet', f'{self.download_path}{today}.parquet')
+        os.remove(f'{self.download_path}{today}.arrows')
+
+    def _poll_until(self, browser, jobs, initial=5, cap=60, factor=1.5):
+        # Download all remaining jobs, polling quickly at first so small jobs finish in seconds,
+        # then backing off up to cap seconds between polls so long jobs don't hammer the server
+        wait = initial
         while any(job['status'] != 3 for job in jobs.values()):
-            time.sleep(sleep)
+            time.sleep(wait)
+            wait = min(cap, wait * factor)
             jobs = self._update_job_status(browser, jobs)
             self._download_job(browser, jobs)                     
 
-    def daily_download(self, sleep=60*2):
+    def daily_download(self, sleep=60):
 
         # All the dates that need to be run, these will be iterated through
         date_list = self._get_dates()
@@ -236,22 +404,25 @@ class RITIS_Downloader:
             print("Data is already updated through yesterday.")
             return
 
+        # Submit all dates as a single job, the download is split back into one file per date
+        name = f'{date_list[0]}_to_{date_list[-1]}'
+
         # Initiate dicitonary to track job status
-        jobs = {key: {'status': 0, 'uuid': ""} for key in date_list}
+        jobs = {name: {'status': 0, 'uuid': "", 'split_by_date': True, 'dates': date_list}}
 
         # Initiate browser and log in
         browser, email = self._login()
 
-        # Step through each date one at a time, from the last run date until today
-        for date in date_list:
-            self._submit_job(browser, email, start_date=date, end_date=date, name=date)
-            # Wait a little and then update status of each job, and download those that are ready
-            time.sleep(sleep)
-            jobs = self._update_job_status(browser, jobs)
-            self._download_job(browser, jobs)
+        # Submit job
+        self._submit_job(browser, email, start_date=date_list[0], end_date=date_list[-1], name=name)
+
+        # Poll job status and download once it is ready
+        self._poll_until(browser, jobs, cap=sleep)
 
-        # Download any remaining jobs
-        self._download_all_remaining(browser, jobs)            
+        # Remove continuous_download streams left behind by a killed run, those dates were just downloaded in full
+        for date in date_list:
+            if os.path.isfile(f'{self.download_path}{date}.arrows'):
+                os.remove(f'{self.download_path}{date}.arrows')
 
         # Close the browser
         browser.close()
@@ -270,7 +441,7 @@ class RITIS_Downloader:
         # Submit job
         self._submit_job(browser, email, start_date=start_date, end_date=end_date, name=job_name)    
         # Download
-        self._download_all_remaining(browser, jobs)
+        self._poll_until(browser, jobs)
         # Close the browser
         browser.close()
 
@@ -291,52 +462,76 @@ class RITIS_Downloader:
         end_process_time = datetime.strptime(f'{today} {self.end_time}', "%Y-%m-%d %H:%M:%S")
         start_time = datetime.strptime(self.start_time, "%H:%M:%S").time()
 
-        while datetime.now() <= end_process_time:
-            # Get current datetime
-            now = datetime.now()
-            # Ok and now wait a bit longer to make sure all the data we want has come in before continuing with next job?
-            time.sleep(15)
-            # After downloading the job, this will determine how long to wait before submitting the next job
-            current_minute = now.minute + now.hour * 60 # minute number of the day to track the update interval/schedule
-            next_step = int(current_minute / self.continuous_download_interval) + 1 # next_step is the next time in the schedule an update will be called for.
-
-            #read the last time data was updated
-            with open(self.last_run, 'r') as f:
-                last_run_datetime = datetime.strptime(f.read(), '%Y-%m-%d %H:%M:%S')
-            name = last_run_datetime.strftime("%Y-%m-%d-%H%M") # it's important that only allowed characters are used.
-            # Set start time
-            start_time = max(start_time, last_run_datetime.time())
-            start_time_str = start_time.strftime("%H:%M:%S")
-
-            # Calculate the most recent end time to use, considering the bin size and current time
-            end_time = now - timedelta(minutes=now.minute % self.bin_size, seconds=now.second, microseconds=now.microsecond)
-            end_time_str = end_time.strftime("%H:%M:%S")
-            
-            # Initiate jobs dictionary for tracking
-            jobs = {name: {'status': 0, 'uuid': ""}}
-  
-            # Submit job
-            self._submit_job(browser, email, start_date=today, end_date=today, start_time=start_time_str, end_time=end_time_str, name=name)    
-            # Download
-            self._download_all_remaining(browser, jobs, sleep=30)
-
-            # Combine files, if needed
-            df = pd.read_parquet(f'{self.download_path}{name}.parquet') # Read in file that was just downloaded
-            os.remove(f'{self.download_path}{name}.parquet') # And delete it
-            #If today's file already exists, read and append it
-            if os.path.isfile(f'{self.download_path}{today}.parquet'): 
-                df2 = pd.read_parquet(f'{self.download_path}{today}.parquet')
-                df = df.append(df2)
-            # Save data as today's file
-            df.to_parquet(f'{self.download_path}{today}.parquet')
-
-            # Update last_run file with the end date/time of the last run
-            with open(self.last_run, 'w') as file:
-                file.write(f'{today} {end_time_str}')
-            
-            # Wait for specified interval before downloading again
-            while (datetime.now().minute + datetime.now().hour * 60) / self.continuous_download_interval < next_step:
-                time.sleep(5)
+        # Each interval is appended to an Arrow IPC stream for today instead of re-reading and rewriting the parquet file,
+        # the stream is compacted into today's parquet file when the process ends
+        stream_path = f'{self.download_path}{today}.arrows'
+        writer = None
+        completed = False
+
+        # A stream left behind by a killed run today is compacted first, so the new stream only holds this run's intervals
+        if os.path.isfile(stream_path):
+            self._compact_today(today)
+
+        try:
+            while datetime.now() <= end_process_time:
+                # Get current datetime
+                now = datetime.now()
+                # Ok and now wait a bit longer to make sure all the data we want has come in before continuing with next job?
+                time.sleep(15)
+                # After downloading the job, this will determine how long to wait before submitting the next job
+                current_minute = now.minute + now.hour * 60 # minute number of the day to track the update interval/schedule
+                next_step = int(current_minute / self.continuous_download_interval) + 1 # next_step is the next time in the schedule an update will be called for.
+
+                #read the last time data was updated
+                with open(self.last_run, 'r') as f:
+                    last_run_datetime = datetime.strptime(f.read(), '%Y-%m-%d %H:%M:%S')
+                name = last_run_datetime.strftime("%Y-%m-%d-%H%M") # it's important that only allowed characters are used.
+                # Set start time
+                start_time = max(start_time, last_run_datetime.time())
+                start_time_str = start_time.strftime("%H:%M:%S")
+
+                # Calculate the most recent end time to use, considering the bin size and current time
+                end_time = now - timedelta(minutes=now.minute % self.bin_size, seconds=now.second, microseconds=now.microsecond)
+                end_time_str = end_time.strftime("%H:%M:%S")
+                
+                # Initiate jobs dictionary for tracking
+                # Interval files are only temporary, so they are never sorted, today's file is sorted when it is compacted
+                jobs = {name: {'status': 0, 'uuid': "", 'sort': False}}
+      
+                # Submit job
+                self._submit_job(browser, email, start_date=today, end_date=today, start_time=start_time_str, end_time=end_time_str, name=name)    
+                # Download
+                self._poll_until(browser, jobs, cap=30)
+
+                # Append to today's file
+                table = pq.read_table(f'{self.download_path}{name}.parquet') # Read in file that was just downloaded
+                os.remove(f'{self.download_path}{name}.parquet') # And delete it
+                if writer is None:
+                    sink = pa.OSFile(stream_path, 'wb')
+                    writer = pa.ipc.new_stream(sink, table.schema)
+                writer.write_table(table)
+
+                # Update last_run file with the end date/time of the last run
+                with open(self.last_run, 'w') as file:
+                    file.write(f'{today} {end_time_str}')
+                
+                # Wait for specified interval before downloading again, sleeping once until the next scheduled step
+                wake = datetime.combine(now.date(), datetime.min.time()) + timedelta(minutes=next_step * self.continuous_download_interval)
+                time.sleep(max(0, (wake - datetime.now()).total_seconds()))
+            completed = True
+        finally:
+            # Compact today's stream into parquet, even if interrupted
+            if writer is not None:
+                writer.close()
+                sink.close()
+                if completed:
+                    self._compact_today(today)
+                else:
+                    # Don't let a compaction error hide the original error, the stream is kept and compacted on the next run today
+                    try:
+                        self._compact_today(today)
+                    except Exception:
+                        pass
 
         # Close the browser
         browser.close()